@@ -18,10 +18,19 @@ class Ball(mujoco_env.MujocoEnv, utils.EzPickle, MujocoBase):
         self.bradius_max_sub = 0.085
         # Domain rand over geometry and color
         self.randomize = True
+        # Preallocated free joint state (pos(3), quat(4)) and velocity (trans(3), angular(3)) written in reset_model
+        #  Sphere orientation does not matter so quat is fixed to identity
+        self._qpos_buf = np.zeros(7)
+        self._qpos_buf[3] = 1.0
+        self._qvel_buf = np.zeros(6)
+        # Preallocated [x_ball, z_ball, vx_ball, vz_ball] written in _get_state, needed during model creation
+        self._state_buf = np.empty(4)
         # - - - - - - - - - - - - - - - -
         MujocoBase.__init__(self)
         mujoco_env.MujocoEnv.__init__(self, xml_path, frame_skip=1)
         utils.EzPickle.__init__(self)
+        # Cache geom id of ball, looked up on every reset while randomizing
+        self._gball_gid = self.sim.model.geom_name2id('gball')
         # Must come after model init
         self.reset_model()
         # Create camera matrix for projection
@@ -32,24 +41,28 @@ class Ball(mujoco_env.MujocoEnv, utils.EzPickle, MujocoBase):
         self.set_state(self.init_qpos, self.init_qvel)
         # Randomize changes via uniform delta perturbations
         ball_dradius = self.np_random.uniform(low=-self.bradius_max_sub, high=self.bradius_max_add)
-        self.sim.model.geom_size[self.sim.model.geom_name2id('gball')] = [self.bradius + ball_dradius,
-                                                                          self.bradius + ball_dradius, 0.0]
+        self.sim.model.geom_size[self._gball_gid, :2] = self.bradius + ball_dradius
+        self.sim.model.geom_size[self._gball_gid, 2] = 0.0
 
     def randomize_color(self):
         randidx = self.np_random.choice(a=self.ncolors)
-        self.sim.model.geom_rgba[self.sim.model.geom_name2id('gball')] = self.color_options[randidx]
+        self.sim.model.geom_rgba[self._gball_gid] = self.color_options[randidx]
 
     def step(self, action: float):
         # Getting state before simulation step and observed frame after is a work around to 1-step delayed obs frame
         state = self._get_state()
-        # Unactuated freely falling ball model
-        action = 0.0
-        self.do_simulation(action, self.frame_skip)
+        # Unactuated freely falling ball model, ctrl of the dummy actuator is never written and stays 0 so
+        #  step the sim directly instead of going through do_simulation which rewrites ctrl every step
+        for _ in range(self.frame_skip):
+            self.sim.step()
         ob = self._get_obs()
-        # Terminate if the ball goes out of view
-        out_of_view_x = np.abs(self.sim.data.qpos[0]) > 1.7 # Earlier tried 2.5
+        # Terminate if the ball goes out of view, compare as python floats to skip numpy scalar ops
+        qpos = self.sim.data.qpos
+        qx = float(qpos[0])
+        qz = float(qpos[2])
+        out_of_view_x = abs(qx) > 1.7 # Earlier tried 2.5
         # On sided ineq since always falls down
-        out_of_view_z = self.sim.data.qpos[2] < -1.7
+        out_of_view_z = qz < -1.7
         out_of_view = out_of_view_x or out_of_view_z
         # self.done is never set to True since there is no task
         done = out_of_view or self.done
@@ -60,8 +73,14 @@ class Ball(mujoco_env.MujocoEnv, utils.EzPickle, MujocoBase):
     # State is [x_ball, z_ball]
     def _get_state(self):
         # x_ball, z_ball, Give perception coordinates and velocities
-        _st = np.hstack((self.sim.data.qpos[0], self.sim.data.qpos[2], self.sim.data.qvel[0], self.sim.data.qvel[2]))
-        return _st
+        qpos = self.sim.data.qpos
+        qvel = self.sim.data.qvel
+        self._state_buf[0] = qpos[0]
+        self._state_buf[1] = qpos[2]
+        self._state_buf[2] = qvel[0]
+        self._state_buf[3] = qvel[2]
+        # Copy since returned states are accumulated by callers
+        return self._state_buf.copy()
 
     def reset(self):
         self.done = False
@@ -71,20 +90,12 @@ class Ball(mujoco_env.MujocoEnv, utils.EzPickle, MujocoBase):
         return self.reset_model()
 
     def reset_model(self):
-        # No variation in y-position (depth)
-        ball_x = self.np_random.uniform(low=-1.0, high=1.0)
-        ball_y = 0.0
-        ball_z = self.np_random.uniform(low=-1.0, high=1.0)
-        ball_xyz = np.array([ball_x, ball_y, ball_z])
-        # Sphere orientation does not matter
-        ball_quat = np.hstack((1.0, np.zeros(3, dtype=np.float64)))
-        ball_free_jnt_state = np.hstack((ball_xyz, ball_quat))
-        # Reset ball velocity randomly in (x, y) dir and 0 for z and rotational
-        ball_vx = self.np_random.uniform(low=-5.0, high=5.0)
-        ball_vy = 0.0
-        ball_vz = self.np_random.uniform(low=-1.0, high=1.0)
-        ball_vxyz = np.array([ball_vx, ball_vy, ball_vz])
-        # Set ball free joint velocity (aka ball velocity) with angular terms = 0
-        ball_free_jnt_vel = np.hstack((ball_vxyz, np.zeros(3, dtype=np.float64)))
-        self.set_state(ball_free_jnt_state, ball_free_jnt_vel)
+        # No variation in y-position (depth), only ball x and z positions are written into the preallocated state
+        self._qpos_buf[0] = self.np_random.uniform(low=-1.0, high=1.0)
+        self._qpos_buf[2] = self.np_random.uniform(low=-1.0, high=1.0)
+        # Reset ball velocity randomly in (x, z) dir and 0 for y and rotational
+        self._qvel_buf[0] = self.np_random.uniform(low=-5.0, high=5.0)
+        self._qvel_buf[2] = self.np_random.uniform(low=-1.0, high=1.0)
+        # Set ball free joint state and velocity, set_state copies these into the simulator
+        self.set_state(self._qpos_buf, self._qvel_buf)
         return self._get_obs()
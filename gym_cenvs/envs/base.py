@@ -18,6 +18,9 @@ class MujocoBase:
         self.data = None
         self.model = None
         self.viewer = None
+        # Offscreen render context observations are rendered with, made on first use in _get_obs
+        #  Separate from the viewers gym keeps per render mode so that it outlives render('human')/close() calls
+        self._render_ctx = None
 
         # Random seed for stuff that happens in mujoco-gym environments (like color randomization)
         random.seed(0)
@@ -34,7 +37,26 @@ class MujocoBase:
 
     def _get_obs(self):
         size_ = self.seg_config.imsize
-        return self.render(mode='rgb_array', width=size_, height=size_, camera_id=0)
+        if self._render_ctx is None:
+            self._render_ctx = self._make_render_ctx()
+        # Camera is already set on the context so none is passed
+        self._render_ctx.render(size_, size_)
+        # Rendered image is upside down
+        return self._render_ctx.read_pixels(size_, size_, depth=False)[::-1, :, :]
+
+    def _make_render_ctx(self):
+        """
+        Make an offscreen render context on self.sim viewing through fixed camera 0, the camera every observation is
+        rendered from, so that _get_obs goes neither through MujocoEnv.render's camera resolution and viewer lookup
+        nor sets the camera up again on every frame
+        :return:
+        """
+        # Imported here since mujoco_py is only needed once an env renders
+        from mujoco_py import MjRenderContextOffscreen, const
+        render_ctx = MjRenderContextOffscreen(self.sim, device_id=-1)
+        render_ctx.cam.type = const.CAMERA_FIXED
+        render_ctx.cam.fixedcamid = 0
+        return render_ctx
 
     # https://github.com/deepmind/dm_control/blob/87e046bfeab1d6c1ffb40f9ee2a7459a38778c74/dm_control/mujoco/engine.py#L686
     def get_cam_mat(self):
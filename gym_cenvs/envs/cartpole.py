@@ -139,10 +139,6 @@ class Cartpole(mujoco_env.MujocoEnv, utils.EzPickle, MujocoBase):
             ]).ravel()
         return _st
 
-    def _get_obs(self):
-        size_ = self.seg_config.imsize
-        return self.render(mode='rgb_array', width=size_, height=size_, camera_id=0)
-
     def reset(self):
         self.done = False
         if self.randomize:
@@ -108,10 +108,6 @@ class Kendama(mujoco_env.MujocoEnv, utils.EzPickle, MujocoBase):
 
         return goal_cost, centre_cost
 
-    def _get_obs(self):
-        size_ = self.seg_config.imsize
-        return self.render(mode='rgb_array', width=size_, height=size_, camera_id=0)
-
     def _get_state(self):
         # Old Tom version
         custom_state = np.concatenate([
@@ -6,6 +6,7 @@ import numpy as np
 from src.agents import MPPI
 from src.simp_mod_library.simp_mod_lib import SimpModLib
 from src.transition_distributions import MMT
+from src.utils import AsyncEnvStepper
 import torch
 from typing import List
 
@@ -14,11 +15,17 @@ class BaseAgent(metaclass=ABCMeta):
     """
     Base class for constructing agents that control the complex object using passed Simple Model Library
     """
-    def __init__(self, smodel_list: List[str], env_name: str):
+    def __init__(self, smodel_list: List[str], env_name: str, store_frames: bool = False):
         self.env_name = env_name
-        self.env = gym.make(self.env_name)
-        self.env.seed(0)
-        self.env.action_space.seed(0)
+        def make_env():
+            env = gym.make(self.env_name)
+            env.seed(0)
+            env.action_space.seed(0)
+            return env
+
+        # With the EGL backend the env is built and stepped on a worker thread so that simulation overlaps with the
+        #  filter predict step, otherwise it is stepped synchronously
+        self.env = AsyncEnvStepper(make_env)
 
         self.device = 'cuda:0'
 
@@ -58,6 +65,19 @@ class BaseAgent(metaclass=ABCMeta):
         self.state_dim = self.model_lib['cartpole'].cfg.state_dimension
         self.device = self.model_lib['cartpole'].cfg.device
 
+        # Prior covariance over state every episode starts from, cloned in reset_trial since updated in place
+        self._prior_sigma = self.model_lib['cartpole'].cfg.prior_cov * torch.eye(self.state_dim,
+                                                                                 device=self.device).unsqueeze(0)
+
+        # Per-step data of an episode is written into buffers preallocated for episode_T steps
+        #  and indexed by the number of steps self._t taken so far in the episode
+        pin = torch.cuda.is_available()
+        self.episode_data = {'action': torch.empty(self.episode_T, self.action_dimension, pin_memory=pin)}
+        self._t = 0
+        # Raw frames are only needed for saving episodes so are stored only when asked for
+        #  (encoded z_mu/z_std are always stored)
+        self.store_frames = store_frames
+
     def get_cost_fn(self, simp_model: str):
         """
         Returns the cost function corresponding to the passed simple model for the task at hand
@@ -78,23 +98,13 @@ class BaseAgent(metaclass=ABCMeta):
         return object.__new__(cls)
 
     def reset_trial(self):
-        #TODO make this a dictionary?
-        self.true_state_history = []
-        self.state_mu_history = []
-        self.state_cov_history = []
-        self.param_cov_history = []
-        self.param_mu_history = []
-        self.action_history = []
-        self.z_mu_history = []
-        self.z_std_history = []
         self.img_history = []
         self.rollout_history = []
         self.viewer_history = []
 
         # Initialise prior for state
         self.x_mu = torch.zeros(1, self.state_dim, device=self.device)
-        self.x_sigma = self.model_lib['cartpole'].cfg.prior_cov * torch.eye(self.state_dim,
-                                                                            device=self.device).unsqueeze(0)
+        self.x_sigma = self._prior_sigma.clone()
 
         self.x_sigma[self.state_dim:, self.state_dim:] *= 0.3
 
@@ -102,8 +112,39 @@ class BaseAgent(metaclass=ABCMeta):
         observation = self.env.reset()
         self.model_lib['cartpole'].cost_fn.set_goal(goal=self.env.get_goal())
         observation, _, _, info = self.env.step(np.zeros(self.model_lib['cartpole'].cfg.action_dimension))
-        self.true_state_history.append(info['state'])
-        self.observation_update(observation)
+        # Dimension of true state is only known once the env returns one, holds initial state + episode_T steps
+        if 'true_state' not in self.episode_data:
+            # Allocated as a normal tensor so it can be written outside inference mode too
+            with torch.inference_mode(False):
+                self.episode_data['true_state'] = torch.empty(self.episode_T + 1, info['state'].shape[0],
+                                                              dtype=torch.float64)
+        self._t = 0
+        self.episode_data['true_state'][0] = torch.from_numpy(info['state'])
+        z_mu, z_std = self.observation_update(observation)
+
+        # Remaining per-step buffers sized from the belief and encoding of the first observation
+        state_dimension = self.model_lib['cartpole'].cfg.state_dimension
+        param_dimension = self.x_mu.size(1) - state_dimension
+        self._episode_buffer('z_mu', z_mu.numel())
+        self._episode_buffer('z_std', z_std.numel())
+        self._episode_buffer('state_mu', state_dimension)
+        self._episode_buffer('state_cov', state_dimension, state_dimension)
+        self._episode_buffer('param_mu', param_dimension)
+        self._episode_buffer('param_cov', param_dimension)
+
+    def _episode_buffer(self, key, *feat_shape):
+        """
+        Returns the buffer of episode_data for key, allocating it with episode_T rows on first use
+        :param key: name of the per-step field
+        :param feat_shape: shape of the field at a single step
+        :return:
+        """
+        if key not in self.episode_data:
+            # First use is typically within do_episode, allocate as a normal tensor so that the buffer can also
+            #  be written outside inference mode (example load_data)
+            with torch.inference_mode(False):
+                self.episode_data[key] = torch.empty(self.episode_T, *feat_shape)
+        return self.episode_data[key]
 
     def render(self):
         raise NotImplementedError
@@ -122,7 +163,9 @@ class BaseAgent(metaclass=ABCMeta):
         return z_mu, z_std
 
     def do_episode(self, action_noise=False):
-        with torch.no_grad():
+        # Pure inference, tensors created within are never used for autograd (example stored episode data is cloned
+        #  in store_episode_data before sys-id)
+        with torch.inference_mode():
             while True:
                 self.reset_trial()
                 done = False
@@ -157,7 +200,7 @@ class BaseAgent(metaclass=ABCMeta):
 
         state = torch.cat((state, torch.zeros_like(state)), dim=1)
         # Get action
-        actions, rollout = self.controller.command(state)
+        actions, rollout = self.controller.command(state, return_rollout=True)
         actions.reshape(-1, self.action_dimension)
 
         #self.CostFn.compute_cost(rollout)
@@ -175,11 +218,13 @@ class BaseAgent(metaclass=ABCMeta):
 
             #print('--')
 
+            # Act in world, the env steps in the background while the effect of the action is predicted
+            #TODO for cartpole need to minus action
+            self.env.send(actions[i].detach().cpu().numpy())
             self.x_mu, self.x_sigma = self.model_lib['cartpole'].trans_dist.predict(actions[i].view(1, -1), self.x_mu, self.x_sigma)
             #print(self.x_mu)
-            # Act in world and get observation
-            #TODO for cartpole need to minus action
-            observation, reward, done, info = self.env.step(actions[i].detach().cpu().numpy())
+            # Get observation
+            observation, reward, done, info = self.env.recv()
             true_state = info['state']
             #print(true_state[:5])
             total_reward += reward
@@ -187,18 +232,21 @@ class BaseAgent(metaclass=ABCMeta):
             z_mu, z_std = self.observation_update(observation)
             #print(z_mu)
             # Log all data from this step
-            self.true_state_history.append(true_state)
-            self.action_history.append(actions[i].cpu().numpy())
-            self.z_mu_history.append(z_mu.cpu().numpy())
-            self.z_std_history.append(z_std.cpu().numpy())
-            self.img_history.append(observation)
-
             state_dimension = self.model_lib['cartpole'].cfg.state_dimension
-
-            self.state_cov_history.append(self.x_sigma[0, :state_dimension, :state_dimension].detach().cpu().numpy())
-            self.state_mu_history.append(self.x_mu[0, :state_dimension].detach().cpu().numpy())
-            self.param_cov_history.append(torch.diag(self.x_sigma[0])[state_dimension:].detach().cpu().numpy())
-            self.param_mu_history.append(self.x_mu[0, state_dimension:].detach().cpu().numpy())
+            episode_data = self.episode_data
+            t = self._t
+
+            episode_data['true_state'][t + 1] = torch.from_numpy(true_state)
+            episode_data['action'][t] = actions[i]
+            episode_data['z_mu'][t] = z_mu.view(-1)
+            episode_data['z_std'][t] = z_std.view(-1)
+            episode_data['state_cov'][t] = self.x_sigma[0, :state_dimension, :state_dimension]
+            episode_data['state_mu'][t] = self.x_mu[0, :state_dimension]
+            episode_data['param_cov'][t] = torch.diag(self.x_sigma[0])[state_dimension:]
+            episode_data['param_mu'][t] = self.x_mu[0, state_dimension:]
+            self._t += 1
+            if self.store_frames:
+                self.img_history.append(observation)
 
             if done:
                 return done, False, total_reward, info
@@ -234,9 +282,10 @@ class BaseAgent(metaclass=ABCMeta):
         D <- D U (mu^y_t, Sigma^y_t, u_t)_{t=1}^{T} where T < self.episode_T = duration of trajectory
         :return:
         """
-        u = torch.from_numpy(np.asarray(self.action_history))    # size: T
-        z_mu = torch.from_numpy(np.asarray(self.z_mu_history)).squeeze(1)   # size: T x obs_dim
-        z_std = torch.from_numpy(np.asarray(self.z_std_history)).squeeze(1) # size: T x obs_dim
+        # Clone since the buffer is overwritten by the next episode
+        u = self.episode_data['action'][:self._t].clone()    # size: T x nu
+        z_mu = self.episode_data['z_mu'][:self._t].clone()     # size: T x obs_dim
+        z_std = self.episode_data['z_std'][:self._t].clone()   # size: T x obs_dim
 
         z_mu, z_std, u = self.chunk_trajectory(z_mu, z_std, u)
 
@@ -267,16 +316,23 @@ class BaseAgent(metaclass=ABCMeta):
 
     def save_episode_data(self, fname):
         # TODO sort this out with proper file directories and stuff
-        actions = np.asarray(self.action_history)
-        z_mu = np.asarray(self.z_mu_history)
-        z_std = np.asarray(self.z_std_history)
+        actions = self.episode_data['action'][:self._t]
+        # Single dimensional actions saved as T like the per-step actions the planner returns for nu == 1
+        if self.action_dimension == 1:
+            actions = actions.view(-1)
+        actions = actions.numpy()
+        # z_mu/z_std saved as T x 1 x obs_dim like the per-step encodings
+        z_mu = self.episode_data['z_mu'][:self._t].unsqueeze(1).numpy()
+        z_std = self.episode_data['z_std'][:self._t].unsqueeze(1).numpy()
+        if not self.store_frames:
+            logging.warning("store_frames is off, saving episode data to {} without observations".format(fname))
         obs = np.asarray(self.img_history)
         goal = np.asarray(self.env.get_goal())
         rollout_hist = np.asarray(self.rollout_history)
         view_history = np.asarray(self.viewer_history)
-        true_history = np.asarray(self.true_state_history)
-        state_mu_history = np.asarray(self.state_mu_history)
-        state_cov_history = np.asarray(self.state_cov_history)
+        true_history = self.episode_data['true_state'][:self._t + 1].numpy()
+        state_mu_history = self.episode_data['state_mu'][:self._t].numpy()
+        state_cov_history = self.episode_data['state_cov'][:self._t].numpy()
 
         np.savez('{}.npz'.format(fname), z_mu, z_std, actions, obs, goal, rollout_hist,
                  view_history, true_history, state_mu_history, state_cov_history)
@@ -287,9 +343,12 @@ class BaseAgent(metaclass=ABCMeta):
             foldername = '../data/trajectories/victor_rope_flossing_no_dr/online/'
             filename = 'with_gp_thick_rope_trial_0_ep_{}.npz'.format(i+1)
             data = np.load(foldername + filename)
-            self.z_mu_history = data['arr_0']
-            self.z_std_history = data['arr_1']
-            self.action_history = data['arr_2']
+            self._t = data['arr_2'].shape[0]
+            self.episode_data['action'][:self._t] = torch.from_numpy(data['arr_2']).view(self._t, -1)
+            z_mu = torch.from_numpy(data['arr_0']).view(self._t, -1)
+            z_std = torch.from_numpy(data['arr_1']).view(self._t, -1)
+            self._episode_buffer('z_mu', z_mu.size(1))[:self._t] = z_mu
+            self._episode_buffer('z_std', z_std.size(1))[:self._t] = z_std
             self.store_episode_data()
 
     def save_rollout(self, rollout):
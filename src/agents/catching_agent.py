@@ -3,8 +3,8 @@ from typing import List
 
 
 class CatchingAgent(BaseAgent):
-    def __init__(self, smodel_list: List[str]):
-        super(CatchingAgent, self).__init__(smodel_list=smodel_list, env_name="Catching-v0")
+    def __init__(self, smodel_list: List[str], store_frames: bool = False):
+        super(CatchingAgent, self).__init__(smodel_list=smodel_list, env_name="Catching-v0", store_frames=store_frames)
 
         # TODO: Have environment name be set in the task definition
         #  but be created in the base class
@@ -3,8 +3,8 @@ from typing import List
 
 
 class ConkersAgent(BaseAgent):
-    def __init__(self, smodel_list: List[str]):
-        super(ConkersAgent, self).__init__(smodel_list=smodel_list, env_name="Conkers-v0")
+    def __init__(self, smodel_list: List[str], store_frames: bool = False):
+        super(ConkersAgent, self).__init__(smodel_list=smodel_list, env_name="Conkers-v0", store_frames=store_frames)
 
 
 
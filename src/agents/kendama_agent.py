@@ -3,5 +3,5 @@ from typing import List
 
 
 class KendamaAgent(BaseAgent):
-    def __init__(self, smodel_list: List[str]):
-        super(KendamaAgent, self).__init__(smodel_list=smodel_list, env_name="Kendama-v0")
+    def __init__(self, smodel_list: List[str], store_frames: bool = False):
+        super(KendamaAgent, self).__init__(smodel_list=smodel_list, env_name="Kendama-v0", store_frames=store_frames)
@@ -42,6 +42,12 @@ class CommonEncConfig:
         # Number of workers in data-loader
         self.num_workers = 2
 
+        # Run encoder members in fp16 for inference in SimpModPerception (gpu only)
+        #  Off by default, encodings differ from fp32 ones, compare with src/perception_tests/encoder-precision-test.py
+        self.half_precision = False
+        # Evaluate all encoder members in a single vmap-ed forward for inference in SimpModPerception (torch >= 2.0)
+        self.vmap_ensemble = False
+
         # Camera matrix path for visualization
         #  All models except for dubins car share their camera matrix
         self.cam_mat_path = "data/cam_matrix.npy"
@@ -29,6 +29,9 @@ class UnscentedKalmanFilter:
 
         self.device = device
 
+        # Identity used in the Joseph form covariance update of update_linear
+        self._eye = torch.eye(self.state_dim, device=self.device)
+
     def update(self, measurement, mu_bar, sigma_bar, measurement_fn, R=None):
         if R is None:
             R = self.R
@@ -79,7 +82,7 @@ class UnscentedKalmanFilter:
         mu = mu_bar.unsqueeze(2) + K.matmul(innov)
 
         # Compute sigma using Joseph's form -- should be better numerically
-        IK_C = torch.eye(self.state_dim, device=self.device) - K.matmul(C)
+        IK_C = self._eye - K.matmul(C)
         KRK = K.matmul(R.matmul(K.transpose(1, 2)))
         sigma = IK_C.matmul(sigma_bar.matmul(IK_C.transpose(1, 2))) + KRK
 
@@ -188,16 +191,12 @@ class UnscentedKalmanFilter:
         return cov
 
     def get_cov(self, mu_x, mu_z, sigma_x, sigma_z, Wc):
-        batch_size = mu_x.size()[0]
         n_sigma = sigma_x.size()[1]
-        nz = mu_z.size()[1]
-        nx = mu_x.size()[1]
-        tmp_x = torch.transpose(torch.transpose(sigma_x, 0, 1) - mu_x, 0, 1).view(-1, n_sigma, nx, 1)
-        tmp_z = torch.transpose(torch.transpose(sigma_z, 0, 1) - mu_z, 0, 1).view(-1, n_sigma, nz, 1)
-        # Need to reshape and duplicate weights so I can do elementwise multiplication
-        Wc_tmp = Wc.view(1, n_sigma, 1, 1).repeat(batch_size, 1, nx, nz)
-
-        return (Wc_tmp * torch.matmul(tmp_x, torch.transpose(tmp_z, 2, 3))).sum(dim=1)
+        # Deviations of sigma points from their means: batch x n_sigma x nx (resp. nz)
+        tmp_x = sigma_x - mu_x.unsqueeze(1)
+        tmp_z = sigma_z - mu_z.unsqueeze(1)
+        # Weighted sum of outer products over sigma points in a single contraction
+        return torch.einsum('bsi,s,bsj->bij', tmp_x, Wc.view(n_sigma), tmp_z)
 
     def get_log_likelihoods(self, smoothed_states, observations, controls, dynamics_fn, measurement_fn, prior_cov):
         smoothed_mu = smoothed_states[0]
@@ -278,13 +277,12 @@ class MerweSigmaPoints:
         # This is a hack that probably slows stuff down but this is a stupid bug
         U = torch.cholesky((self.l + self.n) * sigma.cpu()).to(self.device)
         # U = torch.cholesky((self.l + self.n) * sigma)
-        sigmas = [mu]
-
-        for i in range(self.n):
-            x1 = mu - U[:, :, i]
-            x2 = mu + U[:, :, i]
-            sigmas.extend([x1, x2])
-        return torch.stack(sigmas, 1).view(-1, self.n)
+        # Columns of U perturb mu in -/+ pairs, sigma points are ordered [mu, mu - U_0, mu + U_0, mu - U_1, ...]
+        Ut = U.transpose(1, 2).unsqueeze(2)
+        offsets = torch.cat((-Ut, Ut), dim=2).view(-1, 2 * self.n, self.n)
+        mu = mu.view(-1, 1, self.n)
+        sigmas = torch.cat((mu, mu + offsets), dim=1)
+        return sigmas.view(-1, self.n)
 
     def compute_weights(self):
         Wm = [self.l / (self.n + self.l)]
@@ -26,6 +26,20 @@ class EncoderEnsemble(nn.Module):
         # Whether model in testing mode
         self.test = False
 
+        # Whether encoder members run in fp16, outputs are always returned in fp32
+        self.half_precision = False
+
+        # Weights of all members stacked along a leading ensemble dim for a single vmap-ed forward
+        #  set by stack_ensemble, None means members are run one after the other
+        #  Member weights are views into the stacked ones so there is a single copy of the weights
+        self._ens_params = None
+        self._ens_buffers = None
+
+        # Pinned host buffer observations are staged in for an async copy to gpu, made on first use
+        #  and the event marking when the last copy out of it completed
+        self._obs_staging = None
+        self._obs_copied = None
+
         self.encoder = nn.ModuleList([])
         for i in range(self.config.num_ensembles):
             self.encoder.extend([Encoder(label_dim=self.config.observation_dimension, img_channels=3 * self.nframes)])
@@ -72,7 +86,7 @@ class EncoderEnsemble(nn.Module):
         Calling cuda on NN environment sends model to GPU
         :return:
         """
-        self.encoder.cuda()
+        self.cuda()
 
     def encode(self, observations):
         z_mu, z_std = self.encode_ensemble(observations)
@@ -90,15 +104,26 @@ class EncoderEnsemble(nn.Module):
         z_logvar = []
         N, T, C, W, H = observations.shape
         o = observations.view(N*T, C, W, H)
-
-        for i in range(self.config.num_ensembles):
-            z_mu_tmp, z_logvar_tmp = torch.chunk(self.encoder[i](o), 2, dim=1)
-
-            z_mu.append(z_mu_tmp)
-            z_logvar.append(z_logvar_tmp)
-
-        z_mu = torch.stack(z_mu, dim=0)
-        z_logvar = torch.stack(z_logvar, dim=0)
+        if self.half_precision:
+            o = o.half()
+
+        if self._ens_params is not None:
+            # Ensemble dim becomes a batch dim so all members are evaluated by the same kernels
+            out = torch.func.vmap(self._member_forward, in_dims=(0, 0, None))(self._ens_params, self._ens_buffers, o)
+            z_mu, z_logvar = torch.chunk(out, 2, dim=2)
+        else:
+            for i in range(self.config.num_ensembles):
+                z_mu_tmp, z_logvar_tmp = torch.chunk(self.encoder[i](o), 2, dim=1)
+
+                z_mu.append(z_mu_tmp)
+                z_logvar.append(z_logvar_tmp)
+
+            z_mu = torch.stack(z_mu, dim=0)
+            z_logvar = torch.stack(z_logvar, dim=0)
+
+        # Combining estimates and downstream filtering are always done in fp32
+        z_mu = z_mu.float()
+        z_logvar = z_logvar.float()
         z_var = self.process_zlogvar(z_logvar)
 
         if self.test:
@@ -108,6 +133,45 @@ class EncoderEnsemble(nn.Module):
         N *= self.config.num_ensembles
         return z_mu.reshape(N, T, -1), z_var.sqrt().reshape(N, T, -1)
 
+    def _member_forward(self, params, buffers, o):
+        # All members share the architecture of member 0 so it serves as the template for functional_call
+        return torch.func.functional_call(self.encoder[0], (params, buffers), (o,))
+
+    def stack_ensemble(self):
+        """
+        Stack the weights of all members so that encode_ensemble runs them in a single vmap-ed forward
+        Member weights are then replaced with views into the stacked weights, so in place updates (load_state_dict,
+        optimizer steps) are seen by both and the weights are not held twice
+        .to()/.cuda()/.half() replace member weights with new tensors so _apply stacks again after them
+        No-op when torch.func is unavailable (torch < 2.0)
+        """
+        if not hasattr(torch, 'func'):
+            return
+        params, buffers = torch.func.stack_module_state(list(self.encoder))
+        for idx, member in enumerate(self.encoder):
+            for name, param in params.items():
+                module_name, _, attr = name.rpartition('.')
+                setattr(member.get_submodule(module_name), attr, nn.Parameter(param[idx],
+                                                                              requires_grad=param.requires_grad))
+            for name, buffer in buffers.items():
+                module_name, _, attr = name.rpartition('.')
+                setattr(member.get_submodule(module_name), attr, buffer[idx])
+        self._ens_params, self._ens_buffers = params, buffers
+
+    def _apply(self, fn, *args, **kwargs):
+        super(EncoderEnsemble, self)._apply(fn, *args, **kwargs)
+        # Member weights no longer view the stacked ones after being converted/moved, so stack them again
+        if self._ens_params is not None:
+            self.stack_ensemble()
+        return self
+
+    def unstack_ensemble(self):
+        """
+        Go back to running members one after the other, needed while training members
+        """
+        self._ens_params = None
+        self._ens_buffers = None
+
     def encode_single_obs(self, obs: np.ndarray):
         """
         Only used at test-time / online run-time not during traning
@@ -115,7 +179,19 @@ class EncoderEnsemble(nn.Module):
         :return: z_mu, z_std for configuration estimate
         """
         o = self.preprocess_input(obs)
-        o = o.view(1, 1, -1, self.config.imsize, self.config.imsize).to(device=self.config.device)
+        o = o.view(1, 1, -1, self.config.imsize, self.config.imsize)
+        if torch.device(self.config.device).type == 'cuda':
+            # Copies out of pageable memory are synchronous, stage in pinned memory so the copy is queued
+            #  behind pending gpu work instead of waiting for it
+            if self._obs_staging is None or self._obs_staging.shape != o.shape:
+                self._obs_staging = torch.empty(o.shape, dtype=o.dtype, pin_memory=True)
+                self._obs_copied = torch.cuda.Event()
+            # Previous copy out of the staging buffer must be done before it is overwritten
+            self._obs_copied.synchronize()
+            o = self._obs_staging.copy_(o).to(device=self.config.device, non_blocking=True)
+            self._obs_copied.record()
+        else:
+            o = o.to(device=self.config.device)
         z_mu, z_std = self.encode(o)
         return z_mu.reshape(1, -1), z_std.reshape(1, -1)
 
@@ -164,6 +240,19 @@ class EncoderEnsemble(nn.Module):
         """
         self.test = False
         self.train()
+        self.unstack_ensemble()
+        if self.half_precision:
+            self.float()
+            self.half_precision = False
+
+    def half_mode(self):
+        """
+        Convert encoder members to fp16 for inference on gpu, conv layers are memory bound on 64x64 frames
+        No-op on cpu where fp16 convolutions are not supported
+        """
+        if torch.device(self.config.device).type == 'cuda':
+            self.half()
+            self.half_precision = True
 
     # Do the same pre-processing here that is done while training for the passed HxWxC np.ndarray (single image)
     #  Note must mirror actions by src.traning.torch_dataset_builder.ImageTrajectoryDataset.preprocess_imgs()
@@ -23,6 +23,12 @@ class SimpModPerception(nn.Module):
         # Encoder
         self.encoder = EncoderEnsemble(encoder_model_name, load_model=True)
         self.encoder.send_model_to_gpu()
+        # Perception is only used for inference so encoder can optionally run in fp16
+        if self.encoder.config.half_precision:
+            self.encoder.half_mode()
+        # Optionally run all members batched together
+        if self.encoder.config.vmap_ensemble:
+            self.encoder.stack_ensemble()
         # This wrapper class is only invoked at test time, never at train ...
         # TODO: Uncomment below whjen doing control
         # self.encoder.eval_mode()
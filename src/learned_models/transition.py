@@ -18,7 +18,8 @@ class TransitionModel(nn.Module):
         hidden = self.act_fn(self.fc1(hidden))
         hidden = self.act_fn(self.fc2(hidden))
         z_mu, log_var = torch.chunk(self.fc3(hidden), 2, dim=1)
-        z_std = log_var.exp() / 2.0
+        # std = exp(log_var / 2), log_var clamped so that the std neither overflows nor collapses
+        z_std = torch.exp(0.5 * log_var.clamp(-10, 10))
 
         return z_mu, z_std
 
@@ -72,12 +73,15 @@ class LinearEmission(nn.Module):
         #
         self.C = torch.cat((torch.eye(observation_dim),
                             torch.zeros(observation_dim, state_dim - observation_dim)), dim=1).to(device=device)
+        # Since C = [I | 0] the emission is just the first observation_dim entries of the state
+        self.obs_dim = observation_dim
 
     def get_C(self):
         return self.C
 
     def forward(self, x: torch.Tensor):
-        return F.linear(x, self.C)
+        # Slice instead of F.linear(x, self.C) to skip a GEMM per call
+        return x[..., :self.obs_dim].contiguous()
 
 
 class TransitionDeterministicModel(nn.Module):
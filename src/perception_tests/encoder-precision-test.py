@@ -0,0 +1,78 @@
+"""
+Encoder members can be run in fp16 for inference (config.half_precision), check that the encodings of the fp16
+ensemble stay within a tolerance of those of the fp32 ensemble on the test dataset
+"""
+import argparse
+from src.learned_models.ensemble import EncoderEnsemble
+from src.training import MyDatasetBuilder
+
+
+def main(args):
+    ensemble_fp32 = EncoderEnsemble(args.enc_model_name, load_model=True)
+    ensemble_fp32.send_model_to_gpu()
+
+    ensemble_fp16 = EncoderEnsemble(args.enc_model_name, load_model=True)
+    ensemble_fp16.send_model_to_gpu()
+    ensemble_fp16.half_mode()
+
+    # Get config object of ensemble
+    config = ensemble_fp32.get_config()
+
+    # Exclude all augs list
+    exclude_all_augs_lst = ["no_bg_simp_model", "no_bg_imgnet", "no_fg_texture", "no_bg_shape", "no_noise"]
+    # Make dataloader to iterate over test dataset
+    dataset_builder = MyDatasetBuilder(config=config, excluded_augs=exclude_all_augs_lst)
+
+    test_dataset = dataset_builder.get_dataset(dataset_type='test')
+
+    # Number of test-points
+    ntestpts = 100
+    ctr = 0
+
+    max_mu_err = 0.
+    max_std_err = 0.
+    for obs, state, action in test_dataset:
+        if ctr >= ntestpts:
+            break
+
+        obs = obs.cpu().squeeze().detach()
+        obs = obs.permute((0, 2, 3, 1))
+        obs = obs.numpy()
+
+        for idx in range(len(obs)):
+            z_mu_fp32, z_std_fp32 = ensemble_fp32.encode_single_obs(obs[idx])
+            z_mu_fp16, z_std_fp16 = ensemble_fp16.encode_single_obs(obs[idx])
+
+            max_mu_err = max(max_mu_err, (z_mu_fp32 - z_mu_fp16).abs().max().item())
+            max_std_err = max(max_std_err, (z_std_fp32 - z_std_fp16).abs().max().item())
+
+            ctr += 1
+
+    print("Max abs error fp16 vs fp32 over {0} frames, z_mu: {1:.5f}, z_std: {2:.5f}".format(ctr, max_mu_err,
+                                                                                            max_std_err))
+    if max_mu_err > args.tol or max_std_err > args.tol:
+        raise AssertionError("fp16 encodings of {0} differ from fp32 ones by more than {1}".format(
+            args.enc_model_name, args.tol))
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+
+    parser.add_argument("--enc-model-name",
+                        action='store',
+                        type=str,
+                        help="Name of the .pt file to use in models/encoder",
+                        metavar="enc_model_name",
+                        dest="enc_model_name")
+
+    parser.add_argument("--tol",
+                        action='store',
+                        type=float,
+                        default=1e-2,
+                        help="Max allowed abs difference between fp16 and fp32 encodings",
+                        metavar="tol",
+                        dest="tol")
+
+    args = parser.parse_args()
+
+    main(args)
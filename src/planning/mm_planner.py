@@ -1,17 +1,12 @@
 # Adapted from pytorch-mppi: https://github.com/UM-ARM-Lab/pytorch_mppi
+import numpy as np
 import torch
 import time
 import logging
-from torch.distributions.multivariate_normal import MultivariateNormal
 
 logger = logging.getLogger(__name__)
 
 
-# Implements the rescaling of weights in MPPI paper
-def _ensure_non_zero(cost, beta, factor):
-    return torch.exp(-factor * (cost - beta))
-
-
 class MMplanner:
     """
     The Multiple Nominal Dynamics Priors Equivalent of the usual MPPI algorithm
@@ -88,7 +83,8 @@ class MPPI():
                  u_per_command=1,
                  step_dependent_dynamics=False,
                  sample_null_action=False,
-                 noise_abs_cost=False):
+                 noise_abs_cost=False,
+                 dtype=None):
         """
         :param dynamics: function(state, action) -> next_state (K x nx) taking in batch state (K x nx) and action (K x nu)
         :param trajectory_cost: function(state, action) -> cost (K x 1) taking in batch state and action
@@ -107,9 +103,14 @@ class MPPI():
         :param step_dependent_dynamics: whether the passed in dynamics needs horizon step passed in (as 3rd arg)
         :param sample_null_action: Whether to explicitly sample a null action (bad for starting in a local minima)
         :param noise_abs_cost: Whether to use the absolute value of the action noise to avoid bias when all states have the same cost
+        :param dtype: dtype of the controls, sampled noise and rollouts (example torch.bfloat16 on GPUs with support);
+        defaults to the dtype of noise_sigma
+        costs are always evaluated and accumulated in at least float32
         """
         self.d = device
-        self.dtype = noise_sigma.dtype
+        self.dtype = noise_sigma.dtype if dtype is None else dtype
+        # Summing costs over the horizon in reduced precision quantizes them too coarsely for the softmin weights
+        self.cost_dtype = torch.promote_types(self.dtype, torch.float32)
         self.K = num_samples  # N_SAMPLES
         self.T = horizon  # TIMESTEPS, sometimes called H
 
@@ -148,19 +149,23 @@ class MPPI():
                 self.u_min = torch.tensor(self.u_min, dtype=self.dtype)
             if not torch.is_tensor(self.u_max):
                 self.u_max = torch.tensor(self.u_max, dtype=self.dtype)
-            self.u_min = self.u_min.to(device=self.d)
-            self.u_max = self.u_max.to(device=self.d)
-
-        self.noise_mu = noise_mu.to(self.d)
-        self.noise_sigma = noise_sigma.to(self.d)
-        self.noise_sigma_inv = torch.inverse(self.noise_sigma)
-        self.noise_dist = MultivariateNormal(self.noise_mu, covariance_matrix=self.noise_sigma)
+            self.u_min = self.u_min.to(device=self.d, dtype=self.dtype)
+            self.u_max = self.u_max.to(device=self.d, dtype=self.dtype)
+
+        self.noise_mu = noise_mu.to(device=self.d, dtype=self.dtype)
+        # Inverse and cholesky are computed in (at least) float32 since not supported for half precision
+        noise_sigma = noise_sigma.to(device=self.d, dtype=torch.promote_types(noise_sigma.dtype, torch.float32))
+        self.noise_sigma = noise_sigma.to(dtype=self.dtype)
+        self.noise_sigma_inv = torch.inverse(noise_sigma).to(dtype=self.dtype)
+        # Lower cholesky factor of noise_sigma to sample noise ~ N(noise_mu, noise_sigma) as noise_mu + L eps
+        self.noise_L = torch.linalg.cholesky(noise_sigma).to(dtype=self.dtype)
         # T x nu control sequence
-        self.U = U_init
-        self.u_init = u_init.to(self.d)
+        # Copy since U is shifted and updated in place every command
+        self.U = None if U_init is None else U_init.to(device=self.d, dtype=self.dtype).clone()
+        self.u_init = u_init.to(device=self.d, dtype=self.dtype)
 
         if self.U is None:
-            self.U = self.noise_dist.sample((self.T,))
+            self.U = self._sample_noise(self.T)
 
         self.step_dependency = step_dependent_dynamics
         self.F = dynamics
@@ -168,24 +173,35 @@ class MPPI():
         self.sample_null_action = sample_null_action
         self.noise_abs_cost = noise_abs_cost
         self.state = None
-
         # sampled results from last command
         self.cost_total = None
-        self.cost_total_non_zero = None
         self.omega = None
         self.states = None
         self.actions = None
 
+    def _sample_noise(self, *sample_shape):
+        """
+        Samples control noise directly instead of through a MultivariateNormal (avoids arg validation every call)
+        :param sample_shape: leading dimensions of the samples
+        :returns noise: (*sample_shape x nu)
+        """
+        eps = torch.randn(*sample_shape, self.nu, dtype=self.dtype, device=self.d)
+        if self.nu == 1:
+            # Scalar control so the cholesky factor is just the std
+            return eps.mul_(self.noise_L.view(1)).add_(self.noise_mu)
+        return eps.matmul(self.noise_L.t()).add_(self.noise_mu)
+
     def _dynamics(self, state, u, t):
         return self.F(state, u, t) if self.step_dependency else self.F(state, u)
 
-    def command(self, state):
+    def command(self, state, return_rollout=False):
         """
         :param state: (nx) or (K x nx) current state, or samples of states (for propagating a distribution of states)
-        :returns action: (nu) best action
+        :param return_rollout: Whether to also return the lowest cost sampled trajectory (for visualization)
+        :returns action: (nu) best action, rollout: (1 x T x nx) lowest cost sampled trajectory or None
         """
-        # shift command 1 time step
-        self.U = torch.roll(self.U, -1, dims=0)
+        # shift command 1 time step in place, clone since source and destination overlap
+        self.U[:-1] = self.U[1:].clone()
         self.U[-1] = self.u_init
 
         if not torch.is_tensor(state):
@@ -194,17 +210,13 @@ class MPPI():
 
         cost_total = self._compute_total_cost_batch()
 
-        beta = torch.min(cost_total)
-        # noinspection PyTypeChecker
-        self.cost_total_non_zero = _ensure_non_zero(cost_total, beta, 1 / self.lambda_)
-
-        eta = torch.sum(self.cost_total_non_zero)
-        self.omega = (1. / eta) * self.cost_total_non_zero
+        # Equivalent to the rescaling of weights in the MPPI paper, exp(-(cost - min cost) / lambda) normalized
+        self.omega = torch.softmax(-cost_total / self.lambda_, dim=0)
 
         # - - - - - - - - - - - - - - - - - - - - - - -
-        # Compute the planned action sequence as a weighted sum
-        for t in range(self.T):
-            self.U[t] += torch.sum(self.omega.view(-1, 1) * self.noise[:, t], dim=0)
+        # Compute the planned action sequence as a weighted sum over samples for all time steps at once
+        dU = torch.einsum('k,ktu->tu', self.omega.to(self.noise.dtype), self.noise)
+        self.U += dU
         # - - - - - - - - - - - - - - - - - - - - - - -
 
         # Extract the number of actions agent creating controller asks for in u_per_command
@@ -214,7 +226,10 @@ class MPPI():
         if self.u_per_command == 1:
             actions = actions[0]
 
-        rollout = self.get_rollouts(state)
+        # Reuse the already rolled out sample with lowest cost instead of running the dynamics again
+        rollout = None
+        if return_rollout:
+            rollout = self.states[torch.argmin(self.cost_total)].unsqueeze(0)
 
         return actions, rollout
 
@@ -222,11 +237,11 @@ class MPPI():
         """
         Clear controller state after finishing a trial
         """
-        self.U = self.noise_dist.sample((self.T,))
+        self.U = self._sample_noise(self.T)
 
     def _compute_total_cost_batch(self):
         # parallelize sampling across trajectories
-        self.cost_total = torch.zeros(self.K, device=self.d, dtype=self.dtype)
+        self.cost_total = torch.zeros(self.K, device=self.d, dtype=self.cost_dtype)
 
         # allow propagation of a sample of states (ex. to carry a distribution), or to start with a single state
         if self.state.shape == (self.K, self.nx):
@@ -235,62 +250,74 @@ class MPPI():
             state = self.state.view(1, -1).repeat(self.K, 1)
 
         # resample noise each time we take an action
-        self.noise = self.noise_dist.sample((self.K, self.T))
+        self.noise = self._sample_noise(self.K, self.T)
         # broadcast own control to noise over samples; now it's K x T x nu
         self.perturbed_action = self.U + self.noise
         if self.sample_null_action:
             self.perturbed_action[self.K - 1] = 0
         # naively bound control
-        # self.perturbed_action = self._bound_action(self.perturbed_action)
-        self.perturbed_action = self.perturbed_action.clamp(min=self.u_min, max=self.u_max)
+        self.perturbed_action = self._bound_action(self.perturbed_action)
         # bounded noise after bounding (some got cut off, so we don't penalize that in action cost)
         self.noise = self.perturbed_action - self.U
 
+        self.states, self.actions, traj_cost = self._rollout_and_cost(state, self.perturbed_action)
+        self.cost_total += traj_cost
+
+        # action perturbation cost sum_t lambda * U_t^T Sinv noise_t, with U Sinv (T x nu) formed first (Sinv is
+        #  symmetric) so that no K x T x nu intermediate is materialized
+        U_Sinv = self.U.to(self.cost_dtype) @ self.noise_sigma_inv.to(self.cost_dtype)
+        noise = self.noise.to(self.cost_dtype)
         if self.noise_abs_cost:
-            action_cost = self.lambda_ * torch.abs(self.noise) @ self.noise_sigma_inv
-            # NOTE: The original paper does self.lambda_ * torch.abs(self.noise) @ self.noise_sigma_inv, but this biases
+            perturbation_cost = self.lambda_ * torch.einsum('tu,ktu->k', U_Sinv, torch.abs(noise))
+            # NOTE: The original paper does self.lambda_ * self.noise @ self.noise_sigma_inv, but this biases
             # the actions with low noise if all states have the same cost.
             # With abs(noise) we prefer actions close to the nominal trajectory.
         else:
-            action_cost = self.lambda_ * self.noise @ self.noise_sigma_inv  # Like original paper
-
-        self.states = []
-        self.actions = []
-
-        # Recursively apply the dynamics function to get the K proposed trajectories
-        for t in range(self.T):
-            u = self.u_scale * self.perturbed_action[:, t]
-            state = self._dynamics(state, u, t)
-            # Save total states/actions
-            self.states.append(state)
-            self.actions.append(u)
+            perturbation_cost = self.lambda_ * torch.einsum('tu,ktu->k', U_Sinv, noise)  # Like original paper
+        self.cost_total += perturbation_cost
+        return self.cost_total
 
+    def _rollout_and_cost(self, state, perturbed_action):
+        """
+        Rolls out the K perturbed action sequences from state and costs the resulting trajectories
+        :param state: (K x nx) initial states
+        :param perturbed_action: (K x T x nu) bounded perturbed actions
+        :returns states: (K x T x nx), actions: (K x T x nu), trajectory cost: (K)
+        """
         # Actions is K x T x nu, States is K x T x nx
-        # Converts list to tensor
-        self.actions = torch.stack(self.actions, dim=1)
-        self.states = torch.stack(self.states, dim=1)
+        actions = self.u_scale * perturbed_action
+        states = self._rollout_traj(state, actions)
 
         if self.trajectory_cost:
-            traj_cost = self.trajectory_cost(self.states, self.actions)
-            self.cost_total += traj_cost
-        self.actions /= self.u_scale
+            # Rollouts stay in self.dtype, the cost is evaluated on upcast copies (no-op for float32)
+            traj_cost = self.trajectory_cost(states.to(self.cost_dtype), actions.to(self.cost_dtype))
+        else:
+            traj_cost = torch.zeros(self.K, dtype=self.cost_dtype, device=perturbed_action.device)
+        actions /= self.u_scale
+        return states, actions, traj_cost
 
-        # action perturbation cost
-        perturbation_cost = torch.sum(self.U * action_cost, dim=(1, 2))
-        self.cost_total += perturbation_cost
-        return self.cost_total
+    def _rollout_traj(self, state, actions):
+        """
+        Recursively applies the dynamics function to get the K proposed trajectories
+        :param state: (K x nx) initial states
+        :param actions: (K x T x nu) scaled actions
+        :returns states: (K x T x nx') with nx' the width of the states returned by dynamics
+        """
+        state = self._dynamics(state, actions[:, 0], 0)
+        # Sized from the first dynamics output, dynamics need not return states of width nx
+        states = state.new_empty((state.size(0), self.T) + state.shape[1:])
+        states[:, 0] = state
+        for t in range(1, self.T):
+            state = self._dynamics(state, actions[:, t], t)
+            states[:, t] = state
+        return states
 
     def _bound_action(self, action):
         if self.u_max is not None:
-            for t in range(self.T):
-                u = action[:, self._slice_control(t)]
-                cu = torch.max(torch.min(u, self.u_max), self.u_min)
-                action[:, self._slice_control(t)] = cu
+            # u_min/u_max (nu) broadcast over the leading K x T dims
+            return torch.clamp(action, min=self.u_min, max=self.u_max)
         return action
 
-    def _slice_control(self, t):
-        return slice(t * self.nu, (t + 1) * self.nu)
-
     def get_rollouts(self, state, num_rollouts=1):
         """
         Return the state-sequence corresponding to the MPC planned sequence of actions ...
@@ -316,11 +343,13 @@ class MPPI():
 
 def run_mppi(mppi, env, retrain_dynamics, retrain_after_iter=50, iter=1000, render=True):
     dataset = torch.zeros((retrain_after_iter, mppi.nx + mppi.nu), dtype=mppi.U.dtype, device=mppi.d)
+    # States come from the env as numpy, collected on host and copied into dataset once per retrain window
+    state_buf = np.zeros((retrain_after_iter, mppi.nx))
     total_reward = 0
     for i in range(iter):
         state = env.state.copy()
         command_start = time.perf_counter()
-        action = mppi.command(state)
+        action, _ = mppi.command(state)
         elapsed = time.perf_counter() - command_start
         s, r, _, _ = env.step(action.cpu().numpy())
         total_reward += r
@@ -330,9 +359,12 @@ def run_mppi(mppi, env, retrain_dynamics, retrain_after_iter=50, iter=1000, rend
 
         di = i % retrain_after_iter
         if di == 0 and i > 0:
+            dataset[:, :mppi.nx] = torch.from_numpy(state_buf).to(dataset)
             retrain_dynamics(dataset)
             # don't have to clear dataset since it'll be overridden, but useful for debugging
             dataset.zero_()
-        dataset[di, :mppi.nx] = torch.tensor(state, dtype=mppi.U.dtype)
+            state_buf.fill(0.)
+        state_buf[di] = state
         dataset[di, mppi.nx:] = action
+    dataset[:, :mppi.nx] = torch.from_numpy(state_buf).to(dataset)
     return total_reward, dataset
@@ -16,6 +16,133 @@ from src.simp_mod_datasets import FramesHandler, nsd, SimpleModel
 from src.plotting import GIFmaker, SimpleModViz
 
 
+def push_frame(model: SimpleModel, frames_handler: FramesHandler, nframes: int, prev_obs, cur_obs, state):
+    """
+    Assemble the observation saved for the current step out of the previous and current frames
+    :return: Observation to be pushed, None if cur_obs is only to be used as the prev_obs of the next step
+    """
+    if nframes == 2:
+        # Can only mean that this is the first frame of the trajectory
+        if prev_obs is None:
+            # In case of most of the models, we are interested in making the model
+            #  learn what zero velocity corresponds to, however, in the case of dubins car
+            #  giving it a pair of identical frames with a heading angle label leads to ambiguity
+            #  due to its symmetrical rectangular shape
+            if model.which_model() == 'dubins':
+                return None
+            else:
+                # Set state labels corresponding to velocities to 0
+                model.zero_velocity_states(state)
+                return frames_handler.concat(cur_obs, cur_obs)
+        else:
+            return frames_handler.concat(prev_obs, cur_obs)
+    elif nframes == 1:
+        return cur_obs
+    else:
+        raise ValueError("nframes must be either 1 or 2, found {0} instead".format(nframes))
+
+
+def rollout_serial(model: SimpleModel, traj_len: int, nframes: int, downsample_by: int,
+                   frames_handler: FramesHandler):
+    """
+    Generator over trajectories collected one at a time from the single env in model
+    Trajectories rejected due to early termination are yielded with fewer than traj_len observations
+    :return: yields traj_observations, traj_actions, traj_states
+    """
+    while True:
+        _ = model.reset()
+        # List to hold traj state labels
+        traj_states = []
+        # List to hold traj actions
+        traj_actions = []
+        # List to hold traj observations
+        traj_observations = []
+        # Reset the prev observed frame
+        prev_obs = None
+        # Counter for within 1 trajectory
+        jdx = 0
+        # Step through a model instantiation upto traj_len number of times
+        while jdx < traj_len:
+            # Sample a random action, ignore action space all simple models are 1D
+            action = np.random.uniform(-1.0, 1.0)
+            # action = -1.0
+            # Simulate a step
+            cur_obs, _, done, info = model.step(action)
+            cur_obs = cur_obs[::downsample_by, ::downsample_by, :]
+            # info is a dict from a mujoco model, NA for gym in built envs
+            state = info["state"]
+
+            pushed_obs = push_frame(model, frames_handler, nframes, prev_obs, cur_obs, state)
+
+            # Update prev_obs for next iteration
+            prev_obs = cur_obs
+
+            if pushed_obs is None:
+                continue
+
+            # If early termination criteria reached, reject traj
+            if done:
+                break
+            # We save
+            # cur_obs at t
+            # state at t
+            # action at t-1
+            # print(state)
+            traj_states.append(state)
+            traj_actions.append(action)
+            # Add cur_obs to tmp list, it is important that obs are added AFTER the early_term done condition
+            traj_observations.append(pushed_obs)
+            jdx += 1
+        yield traj_observations, traj_actions, traj_states
+
+
+def rollout_vec(model: SimpleModel, traj_len: int, nframes: int, downsample_by: int,
+                frames_handler: FramesHandler):
+    """
+    Generator over trajectories collected from model.nenvs envs stepped in lockstep
+    The vector env resets an env as soon as it is done, envs that complete traj_len steps idle till their time limit
+    :return: yields traj_observations, traj_actions, traj_states
+    """
+    nenvs = model.nenvs
+    # Per env lists of traj observations, actions and state labels
+    traj_observations = [[] for _ in range(nenvs)]
+    traj_actions = [[] for _ in range(nenvs)]
+    traj_states = [[] for _ in range(nenvs)]
+    prev_obs = [None] * nenvs
+    # Envs waiting on a reset after completing a trajectory
+    idle = [False] * nenvs
+    while True:
+        # Sample a batch of random actions, ignore action space all simple models are 1D
+        actions = np.random.uniform(-1.0, 1.0, size=nenvs)
+        # Simulate a step in every env, obs is nenvs x H x W x C
+        obs, _, dones, infos = model.step(actions)
+        for edx in range(nenvs):
+            if not (idle[edx] or dones[edx]):
+                cur_obs = obs[edx, ::downsample_by, ::downsample_by, :]
+                state = infos[edx]["state"]
+                pushed_obs = push_frame(model, frames_handler, nframes, prev_obs[edx], cur_obs, state)
+                # Update prev_obs for next iteration
+                prev_obs[edx] = cur_obs
+                if pushed_obs is None:
+                    continue
+                traj_states[edx].append(state)
+                traj_actions[edx].append(actions[edx])
+                traj_observations[edx].append(pushed_obs)
+                if len(traj_observations[edx]) < traj_len:
+                    continue
+                idle[edx] = True
+            elif idle[edx]:
+                # Wait for the time limit to reset this env, nothing to yield
+                idle[edx] = not dones[edx]
+                continue
+            # Either a complete trajectory or one rejected due to early termination
+            yield traj_observations[edx], traj_actions[edx], traj_states[edx]
+            traj_observations[edx] = []
+            traj_actions[edx] = []
+            traj_states[edx] = []
+            prev_obs[edx] = None
+
+
 def main(args):
     # Attempt to create EncDataset object out of provided folder name
     enc_dataset = EncDataset(data_dir_name=args.folder)
@@ -53,6 +180,11 @@ def main(args):
         # Create and seed a gym object for the environment
         model = SimpleModel(simp_model=simp_model, seed=env_seed)
 
+        # Fail before any env is built if a batch of envs is asked for a model that cannot be batched
+        if args.nenvs > 1 and not model.supports_vec_env():
+            raise ValueError("--nenvs {0} > 1 not supported for {1}, use --nenvs 1".format(args.nenvs,
+                                                                                         model.long_name))
+
         seed(args.seed)
 
         model.make_env()
@@ -84,68 +216,19 @@ def main(args):
         tmp_dir_path = frames_handler.dir_manager.add_location('tmp', cur_dataset_path +
                                                                '/tmp_{0}'.format(args.datasets[idx]))
 
+        # Collect trajectories from a batch of envs stepped in lockstep, or from a single env
+        if args.nenvs > 1:
+            model.close()
+            # Extra steps allow an env that has completed a trajectory to idle until its time limit resets it
+            model.make_vec_env(nenvs=args.nenvs, max_episode_steps=args.len[idx] + 2)
+            trajectories = rollout_vec(model, args.len[idx], nframes, downsample_by, frames_handler)
+        else:
+            trajectories = rollout_serial(model, args.len[idx], nframes, downsample_by, frames_handler)
+
         # Collect observations from ntraj number of trajectories for a sequence of trajlen number of random actions
+        #  the count is checked before every rollout so that no trajectory beyond ntraj is simulated
         while traj_idx < args.ntraj[idx]:
-            _ = model.reset()
-            # List to hold traj state labels
-            traj_states = []
-            # List to hold traj actions
-            traj_actions = []
-            # List to hold traj observations
-            traj_observations = []
-            # Reset the prev observed frame
-            prev_obs = None
-            # Counter for within 1 trajectory
-            jdx = 0
-            # Step through a model instantiation upto args/len() number of times
-            while jdx < args.len[idx]:
-                # Sample a random action, ignore action space all simple models are 1D
-                action = np.random.uniform(-1.0, 1.0)
-                # action = -1.0
-                # Simulate a step
-                cur_obs, _, done, info = model.step(action)
-                cur_obs = cur_obs[::downsample_by, ::downsample_by, :]
-                # info is a dict from a mujoco model, NA for gym in built envs
-                state = info["state"]
-
-                if nframes == 2:
-                    # Can only mean that this is the first frame of the trajectory
-                    if prev_obs is None:
-                        # In case of most of the models, we are interested in making the model
-                        #  learn what zero velocity corresponds to, however, in the case of dubins car
-                        #  giving it a pair of identical frames with a heading angle label leads to ambiguity
-                        #  due to its symmetrical rectangular shape
-                        if simp_model == 'dubins':
-                            # Update prev_obs for next iteration
-                            prev_obs = cur_obs
-                            continue
-                        else:
-                            pushed_obs = frames_handler.concat(cur_obs, cur_obs)
-                            # Set state labels corresponding to velocities to 0
-                            model.zero_velocity_states(state)
-                    else:
-                        pushed_obs = frames_handler.concat(prev_obs, cur_obs)
-                elif nframes == 1:
-                    pushed_obs = cur_obs
-                else:
-                    raise ValueError("nframes must be either 1 or 2, found {0} instead".format(nframes))
-
-                # Update prev_obs for next iteration
-                prev_obs = cur_obs
-
-                # If early termination criteria reached, reject traj
-                if done:
-                    break
-                # We save
-                # cur_obs at t
-                # state at t
-                # action at t-1
-                # print(state)
-                traj_states.append(state)
-                traj_actions.append(action)
-                # Add cur_obs to tmp list, it is important that obs are added AFTER the early_term done condition
-                traj_observations.append(pushed_obs)
-                jdx += 1
+            traj_observations, traj_actions, traj_states = next(trajectories)
             # If traj was len long, then save to disk
             #  We accept 1 less than passed traj length for dubins car 2 frame dataset
             if len(traj_observations) == args.len[idx] and args.save:
@@ -219,6 +302,14 @@ if __name__ == '__main__':
                         help="random seed for reproducability",
                         metavar=None)
 
+    parser.add_argument("--nenvs",
+                        action='store',
+                        default=1,
+                        type=int,
+                        help="Number of envs stepped in lockstep in separate processes to collect trajectories",
+                        metavar="nenvs",
+                        dest="nenvs")
+
     parser.add_argument("--save-traj-viz",
                         action='store_true',
                         help="Save the visualization of the trajectory as a GIF",
@@ -58,6 +58,8 @@ class SimpleModel:
         # Create uninitialized environment
         self.env = None
         self.seed = seed
+        # Number of envs stepped in lockstep by self.env, > 1 only once make_vec_env has been called
+        self.nenvs = 1
 
         self.twin = twin
 
@@ -97,6 +99,47 @@ class SimpleModel:
         self.env.action_space.seed(self.seed)
         self.reset()
 
+    def supports_vec_env(self):
+        """
+        :return: Whether make_vec_env can batch this model, not the case for models with mjcf augmentations since
+        a single env is recompiled and remade on every reset for these
+        """
+        return self.long_name not in self.mjcf_augmentations
+
+    def make_vec_env(self, nenvs: int, max_episode_steps: int):
+        """
+        Make a batch of nenvs envs stepped in lockstep in separate worker processes
+        Workers are spawned rather than forked since the caller may already hold an env rendering offscreen in this
+        process and mujoco_py's GL contexts do not survive a fork
+        Envs are reset by the vector env as soon as they are done so a time limit is imposed to
+        have every env periodically start a fresh trajectory
+        :param nenvs: Number of envs in batch
+        :param max_episode_steps: Number of steps after which an env is done and reset
+        :return:
+        """
+        if not self.supports_vec_env():
+            raise ValueError("--nenvs > 1 (vectorized envs) not supported for {0}".format(self.long_name))
+        self.env = gym.vector.AsyncVectorEnv([self._vec_env_fn(self.long_name, max_episode_steps, self.seed + rank)
+                                              for rank in range(nenvs)], context='spawn')
+        self.nenvs = nenvs
+        # Env idx in batch is seeded with self.seed + idx
+        self.env.seed(self.seed)
+        self.env.reset()
+
+    @staticmethod
+    def _vec_env_fn(long_name: str, max_episode_steps: int, seed: int):
+        """
+        :return: Callable that makes a time limited env inside a vector env worker process
+        Some envs (ex: dubins) sample their reset state from the global np.random state, so the global state of
+        every worker is seeded with its own seed before making the env
+        Spawned workers start from a fresh interpreter, gym_cenvs is imported to register the custom envs there
+        """
+        def env_fn():
+            import gym_cenvs
+            np.random.seed(seed)
+            return gym.wrappers.TimeLimit(gym.make(long_name), max_episode_steps=max_episode_steps)
+        return env_fn
+
     def reset(self):
         # On every reset, recompile a doublecartpole_dynamic file, close current environment
         #  and remake a new environment with the new dynamic file
@@ -115,12 +158,13 @@ class SimpleModel:
 
     def close(self):
         self.env.close()
+        self.nenvs = 1
 
     def step(self, action: float):
         """
         Wrapper around the step of self.env to also return the mask(s) over the observation
         Example returns both a Ball mask and a cartpole mask for a cartpole image
-        param: Action to step with
+        param: Action to step with, an array of nenvs actions for a vectorized env
         return: a dictionary of masks contained in obs in addition to =returns by env.step()
         """
         # Action space of gym environment is 3D for Dubins Car env
@@ -2,9 +2,12 @@
 Module contains cost functions for planning with a simple model dynamics prior
 The cost functions assume that the goal region (in some abstract sense) is known as a simple model state
 """
+import logging
 import torch
 from torch import nn
 
+logger = logging.getLogger(__name__)
+
 
 # TODO: A single MMCost entity may not be needed if changing the way planning is performed
 #  But for initial experimentation, the standard MPPI code is being used so this is needed
@@ -57,6 +60,14 @@ class CartpoleTipCost(nn.Module):
         self.l = l
         self.uncertainty_cost = 0.0
         self.iter = 0.0
+        # Log intermediate costs of single trajectory (N == 1) evaluations, formatting them syncs with the GPU
+        self.debug = False
+        # Discount powers 0.9^t over the horizon cached per (T, device)
+        #  Cached tensors are first made within BaseAgent.do_episode's inference mode, they are created as normal
+        #  tensors so that the cost can still be evaluated outside inference mode (example with autograd)
+        self._gammas_cache = {}
+        # Per dimension weights on squared uncertainty, moved to the device of the states on first use
+        self._unc_weight = torch.tensor([0.01, 0.01, 0.01, 0.01, 0.01]).unsqueeze(1)
 
     def set_goal(self, goal):
         self.goal = goal
@@ -72,39 +83,31 @@ class CartpoleTipCost(nn.Module):
         """
         N, T, _ = state.shape
 
-        zeros = torch.zeros(N, T, device=state.device)
-        ones = torch.ones(N, T, device=state.device)
-
         base_x = state[:, :, 0]
         tip_x = state[:, :, 1]
         tip_y = state[:, :, 2]
         rope_theta = torch.atan2(tip_y, tip_x - base_x)
-        goal_theta = torch.atan2(torch.tensor(self.goal[1], device=state.device),
-                                 self.goal[0] - base_x)
+        # Goal y as a 0-d tensor (atan2 takes no python scalars) that broadcasts against the states, a 0-d cpu
+        #  tensor is used as a scalar by gpu kernels so nothing is filled or copied over per call
+        goal_y = torch.as_tensor(self.goal[1], dtype=base_x.dtype)
+        goal_theta = torch.atan2(goal_y, self.goal[0] - base_x)
         # If approx same theta, then there may be a collision
-        collision = torch.where(torch.abs(rope_theta - goal_theta) < 0.2, ones, zeros)
-
-        if N == 1:
-            print('angle check')
-            print(collision)
+        angle_ok = torch.abs(rope_theta - goal_theta) < 0.2
 
         # If the length is greater than the length of the rope (minus the mass), then no collision
-        length = torch.sqrt((tip_x - base_x)**2 + tip_y**2)
-        base_to_target_d = torch.sqrt((self.goal[0] - base_x)**2 + (self.goal[1])**2)
+        length = torch.hypot(tip_x - base_x, tip_y)
+        base_to_target_d = torch.hypot(self.goal[0] - base_x, goal_y)
 
         # When goal is further than length, clearly rope cannot collide
-        collision = torch.where(base_to_target_d > 0.9 * length, zeros, collision)
-        if N == 1:
-            print('length check')
-            print(collision)
+        length_ok = base_to_target_d <= 0.9 * length
 
         # When base to target id is too low
-        collision = torch.where(base_to_target_d < 0.2, ones, collision)
-        if N == 1:
-            print('base check')
-            print(collision)
+        too_close = base_to_target_d < 0.2
 
-        return collision
+        if self.debug and N == 1:
+            logger.debug("angle check\n%s\nlength check\n%s\nbase check\n%s", angle_ok, length_ok, too_close)
+
+        return ((angle_ok & length_ok) | too_close).to(state.dtype)
 
     def forward(self, state, actions=None, verbose=False):
         N, T, _ = state.shape
@@ -115,45 +118,44 @@ class CartpoleTipCost(nn.Module):
         uncertainty = state[:, :, 5:]
 
         # Target cost -- 0 if goal reached in horizon, else it is distance of the end state from goal
-        dist_2_goal = torch.sqrt((self.goal[0] - tip_x) ** 2 + (self.goal[1] - tip_y) ** 2)
+        dist_2_goal = torch.hypot(self.goal[0] - tip_x, self.goal[1] - tip_y)
 
         collisions = self.check_rope_collision(state)
 
-        if N == 1:
-            print(collisions)
+        if self.debug and N == 1:
+            logger.debug("collisions\n%s", collisions)
 
-        # Get components where this is zero
-        at_target = (dist_2_goal < 0.1).nonzero()
-        in_collision = (collisions == 1).nonzero()
+        # First time step within horizon each trajectory reaches the target/collides, T if it never does
+        steps = torch.arange(T, device=state.device)
+        t_target = T - ((dist_2_goal < 0.1).cumsum(dim=1) > 0).sum(dim=1, keepdim=True)
+        t_collision = T - ((collisions == 1).cumsum(dim=1) > 0).sum(dim=1, keepdim=True)
 
         from_centre_cost = (base_x).clamp(min=1.5) - 1.5
         vel_cost = state[:, :, 4:5].abs().sum(dim=2)
-        uncertainty_cost = uncertainty.clone() ** 2
-
-        for t in range(T - 1, -1, -1):
-            # count down
-            at_target_idx = (at_target[:, 1] == t).nonzero()
-            at_target_t = at_target[at_target_idx, 0]
-
-            in_collision_idx = (in_collision[:, 1] == t).nonzero()
-            in_collision_t = in_collision[in_collision_idx, 0]
-
-            collisions[at_target_t, t + 1:] = 0
-            dist_2_goal[at_target_t, t + 1:] = 0
-            dist_2_goal[in_collision_t, t:] = 10 * 0.9**(t)
-            #uncertainty_cost[in_collision_t, t:] = uncertainty_cost[in_collision_t, t - 1].unsqueeze(2)
-            #uncertainty_cost[at_target_t, t + 1:] = 0
-
-
-        if N == 1:
-            print(dist_2_goal)
-        alphas = torch.arange(0, T, device=state.device)
-        gammas = torch.pow(torch.tensor(.9, device=state.device), alphas)
+        uncertainty_cost = uncertainty ** 2
+
+        # Once at target the distance cost is 0 from the next step on, once in collision the cost is fixed to the
+        #  decayed collision cost 10 * 0.9^t_collision from that step on, whichever happens first (collision on a tie)
+        dist_2_goal = dist_2_goal.masked_fill(steps > t_target, 0.0)
+        dist_2_goal = torch.where((steps >= t_collision) & (t_collision <= t_target),
+                                  10 * 0.9 ** t_collision.to(dist_2_goal.dtype), dist_2_goal)
+
+        if self.debug and N == 1:
+            logger.debug("dist_2_goal\n%s", dist_2_goal)
+        gammas = self._gammas_cache.get((T, state.device))
+        if gammas is None:
+            with torch.inference_mode(False):
+                alphas = torch.arange(0, T, device=state.device)
+                gammas = torch.pow(torch.tensor(.9, device=state.device), alphas)
+            self._gammas_cache[(T, state.device)] = gammas
         from_centre_cost *= gammas
         cost = dist_2_goal + 10.0 * from_centre_cost + 1e-5 * vel_cost# + 100 * collision_cost
 
         #uncertainty_cost = uncertainty_cost * gammas.view(1, T)
-        uncertainty_cost = uncertainty_cost @ torch.tensor([0.01, 0.01, 0.01, 0.01, 0.01], device=uncertainty_cost.device).unsqueeze(1)
+        if self._unc_weight.device != uncertainty_cost.device:
+            with torch.inference_mode(False):
+                self._unc_weight = self._unc_weight.to(device=uncertainty_cost.device)
+        uncertainty_cost = uncertainty_cost @ self._unc_weight
         uncertainty_cost = uncertainty_cost.sum(dim=1).squeeze(1)
         uncertainty_cost = uncertainty_cost - uncertainty_cost.mean()
 
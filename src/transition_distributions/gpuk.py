@@ -134,6 +134,9 @@ class GPUnscentedKalman(HeuristicUnscentedKalman):
             B = N
             num_batches = 1
 
+        # Rows of identity select the batch of initial states while keeping the graph to x0_mu/x0_logvar
+        eye_N = torch.eye(N, device=self.config.device)
+
         for it in range(self.config.online_epochs):
             for batch in range(num_batches):
                 optimiser.zero_grad()
@@ -143,7 +146,7 @@ class GPUnscentedKalman(HeuristicUnscentedKalman):
 
                 batch_start = B * batch
                 batch_end = B * (batch+1)
-                batch_selector = torch.eye(N, device=self.config.device)[batch_start:batch_end]
+                batch_selector = eye_N[batch_start:batch_end]
 
                 z_mu_batch = z_mu[batch_start:batch_end]
                 z_std_batch = z_std[batch_start:batch_end]
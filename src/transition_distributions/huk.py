@@ -3,7 +3,7 @@ import torch
 from torch import nn
 from src.filters import UnscentedKalmanFilter
 from src.learned_models import TransitionDeterministicModel, LinearEmission
-from torch.distributions import Normal, MultivariateNormal
+from torch.distributions import Normal
 from torch.distributions.kl import kl_divergence
 
 
@@ -41,6 +41,9 @@ class HeuristicUnscentedKalman(nn.Module):
         self.saved_data = None
         self.start = 0
 
+        # Number of (initial state, param) samples rolled out per trajectory during sys-id in train_on_episode
+        self.n_fit_samples = 100
+
     def predict(self, action, state_mu, state_sigma, transition=None, Q=None):
         if self.config.use_sqrt_ukf:
             state_S = state_sigma.cholesky()
@@ -89,6 +92,58 @@ class HeuristicUnscentedKalman(nn.Module):
     def smooth(self, forward_states):
         return self.ukf.smooth(forward_states)
 
+    def _fit_params_loss(self, dynamics_fn, param_mu, param_logstd, x0_mu, x0_logvar, z_mu, z_std, a_seq):
+        """
+        Negative ELBO of observed trajectories under dynamics rolled out from sampled initial states and params
+        :param dynamics_fn: dynamics taking states enhanced with params
+        :param param_mu: param_dim mean of params
+        :param param_logstd: param_dim log std of params
+        :param x0_mu: N x state_dim mean of initial states
+        :param x0_logvar: N x state_dim log variance of initial states
+        :param z_mu: N x T x obs_dim observed means
+        :param z_std: N x T x obs_dim observed std-devs
+        :param a_seq: T x (n_samples * N) x nu actions repeated for every sample
+        :return: loss averaged over trajectories
+        """
+        N, T, _ = z_mu.size()
+        n_samples = self.n_fit_samples
+
+        # Standard normal priors over initial state and params
+        prior_x = Normal(torch.zeros_like(x0_mu), torch.ones_like(x0_mu))
+        prior_param = Normal(torch.zeros_like(param_mu), torch.ones_like(param_mu))
+
+        # Sample from first state
+        x_mu = x0_mu.view(N, -1)
+        # Covariance over initial state is diagonal so sample from independent normals instead of a
+        #  MultivariateNormal which does a cholesky on construction
+        x_std = (x0_logvar.exp() + 1e-3).sqrt()
+        #x_mu, x_sigma = angular_transform(x_mu, x_sigma, 1)
+        px = Normal(x_mu, x_std)
+        x = px.rsample(sample_shape=(n_samples,))
+        pparam = Normal(param_mu, param_logstd.exp())
+        params = pparam.rsample(sample_shape=(n_samples, N,))
+
+        x_enhanced = torch.cat((x, params), dim=2)
+
+        x = [x_enhanced[:, :, :5]]
+        for t in range(T-1):
+            x_enhanced = dynamics_fn(x_enhanced.view(N*n_samples, -1), a_seq[t]).view(n_samples, N, -1)
+            x.append(x_enhanced[:, :, :5])
+
+        x = torch.stack(x, dim=2)
+
+        z_pred = x[:, :, :, :3]
+
+        #loss = ((z_pred - z_mu.view(1, N, T, -1).repeat(n_samples, 1, 1, 1)) ** 2) / (n_samples * T)
+        #loss = loss.sum(dim=3).sum(dim=2).sum(dim=0)
+        pz = Normal(z_mu, z_std)
+        loss = -pz.log_prob(z_pred).sum(dim=3).sum(dim=2).sum(dim=0) / (n_samples * T)
+
+        kl_regularisation = kl_divergence(pparam, prior_param).sum() + kl_divergence(px, prior_x).sum()
+        loss += kl_regularisation
+        #loss_masked = torch.where(loss < loss_bound, loss, torch.zeros_like(loss))
+        return loss.sum() / N
+
     def train_on_episode(self):
         logging.debug("Entered train episode of HUK ... ")
         """
@@ -142,48 +197,17 @@ class HeuristicUnscentedKalman(nn.Module):
                 lr=self.config.online_lr * 0.01
             )
 
-            n_samples = 100
+            # size: T x (n_samples * N) x nu, laid out like the flattened (n_samples, N) batch of the rollout
+            n_samples = self.n_fit_samples
+            a_seq = u.transpose(0, 1).unsqueeze(1).expand(T, n_samples, N, self.config.action_dimension)
+            a_seq = a_seq.reshape(T, n_samples * N, self.config.action_dimension)
+
             start = self.start
             for it in range(start, 5 * self.config.online_epochs):
                 loss_bound = max(1 - it * 0.01, 0.01)
 
                 optimiser.zero_grad()
-
-                # Sample from first state
-                x_mu = x0_mu.view(N, -1)
-                x_sigma = torch.diag_embed(x0_logvar.exp() + 1e-3)
-                #x_mu, x_sigma = angular_transform(x_mu, x_sigma, 1)
-                px = torch.distributions.MultivariateNormal(x_mu, x_sigma)
-                x = px.rsample(sample_shape=(n_samples,))
-                pparam = Normal(param_mu, param_logstd.exp())
-                params = pparam.rsample(sample_shape=(n_samples, N,))
-
-
-                x_enhanced = torch.cat((x, params), dim=2)
-
-                x = [x_enhanced[:, :, :5]]
-                for t in range(T-1):
-                    a = u[:, t].view(1, -1, self.config.action_dimension).repeat(n_samples, 1, 1)
-
-                    x_enhanced = dynamics_fn(x_enhanced.view(N*n_samples, -1),
-                                             a.view(N*n_samples, -1)).view(n_samples, N, -1)
-                    x.append(x_enhanced[:, :, :5])
-
-                x = torch.stack(x, dim=2)
-
-                z_pred = x[:, :, :, :3]
-
-                #loss = ((z_pred - z_mu.view(1, N, T, -1).repeat(n_samples, 1, 1, 1)) ** 2) / (n_samples * T)
-                #loss = loss.sum(dim=3).sum(dim=2).sum(dim=0)
-                pz = Normal(z_mu, z_std)
-                loss = -pz.log_prob(z_pred).sum(dim=3).sum(dim=2).sum(dim=0) / (n_samples * T)
-
-                prior_x = MultivariateNormal(torch.zeros_like(x_mu), torch.diag_embed(torch.ones_like(x_mu)))
-                prior_param = Normal(torch.zeros_like(param_mu), torch.ones_like(param_mu))
-                kl_regularisation = kl_divergence(pparam, prior_param).sum() + kl_divergence(px, prior_x).sum()
-                loss += kl_regularisation
-                #loss_masked = torch.where(loss < loss_bound, loss, torch.zeros_like(loss))
-                loss = loss.sum() / N
+                loss = self._fit_params_loss(dynamics_fn, param_mu, param_logstd, x0_mu, x0_logvar, z_mu, z_std, a_seq)
                 loss.backward()
                 optimiser.step()
 
@@ -1,3 +1,4 @@
+from src.utils.async_env_stepper import AsyncEnvStepper
 from src.utils.cached_data import CachedData
 from src.utils.geom_utils import get_arc_patch
 from src.utils.results_dir_manager import ResultDirManager
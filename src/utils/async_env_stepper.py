@@ -0,0 +1,95 @@
+from concurrent.futures import Future, ThreadPoolExecutor
+import os
+
+
+def egl_backend_active():
+    """
+    :return: Whether mujoco_py was built with the EGL (headless GPU) backend for offscreen rendering
+    The extension module name records the builder it was built with, EGL for linuxgpuextensionbuilder
+    """
+    try:
+        from mujoco_py import cymj
+    except ImportError:
+        return False
+    return 'linuxgpuextensionbuilder' in os.path.basename(cymj.__file__)
+
+
+class AsyncEnvStepper:
+    """
+    Wrapper around a gym environment that runs env.step on a background worker thread
+    Allows the caller to post an action with send(), do other work (example filter predict) while MuJoCo
+    simulates and renders, and then collect the result with recv()
+    All calls that touch the simulation/rendering are run on the same worker thread since the GL context
+    used for rendering observations is bound to the thread that created it, this includes building the env
+    (MujocoEnv.__init__ steps and so renders) which is why the stepper takes a factory instead of a built env
+    Requires mujoco_py built with the EGL backend, the only one whose contexts may live off the main thread,
+    GLFW in particular must only be used from the main thread. With any other backend the env is built and
+    stepped synchronously on the calling thread, send() then steps right away and recv() returns the result
+    """
+    def __init__(self, env_fn):
+        """
+        :param env_fn: callable with no arguments that builds (and seeds) the env, run on the worker thread
+        """
+        # Single worker so that env calls are serialized in the order they are posted, None if stepping in place
+        self._executor = ThreadPoolExecutor(max_workers=1) if egl_backend_active() else None
+        # Future for the single in-flight step
+        self._pending = None
+        self.env = self._submit(env_fn).result()
+
+    def __getattr__(self, name):
+        # Guard against recursion when env itself has not been set yet (example while unpickling)
+        if name == 'env':
+            raise AttributeError(name)
+        # Everything other than stepping/resetting (example get_goal, dt) is forwarded to the wrapped env
+        return getattr(self.env, name)
+
+    def _submit(self, fn, *args):
+        """
+        Run fn on the worker thread, or right away on the calling thread when there is no worker
+        :return: Future holding the result of fn
+        """
+        if self._executor is not None:
+            return self._executor.submit(fn, *args)
+        future = Future()
+        try:
+            future.set_result(fn(*args))
+        except BaseException as e:
+            future.set_exception(e)
+        return future
+
+    def send(self, action):
+        """
+        Post an action to the env without waiting on the step to complete
+        :param action: action to step env with
+        :return:
+        """
+        if self._pending is not None:
+            raise RuntimeError("send called twice without a recv for the previous action")
+        self._pending = self._submit(self.env.step, action)
+
+    def recv(self):
+        """
+        Block until the previously posted step completes
+        :return: obs, reward, done, info as returned by env.step
+        """
+        if self._pending is None:
+            raise RuntimeError("recv called without a pending action")
+        result = self._pending.result()
+        self._pending = None
+        return result
+
+    def step(self, action):
+        self.send(action)
+        return self.recv()
+
+    def reset(self):
+        # Drop the result of a step left in-flight (example by an exception in the caller between send and recv)
+        if self._pending is not None:
+            self._pending.exception()
+            self._pending = None
+        return self._submit(self.env.reset).result()
+
+    def close(self):
+        self._submit(self.env.close).result()
+        if self._executor is not None:
+            self._executor.shutdown()